@@ -6,13 +6,226 @@ with a cut piece from the image moving around and occasionally aligning perfectl
 """
 
 import subprocess
+import json
+import hashlib
 import random
 import math
 import os
 import argparse
+import re
+import tempfile
+from collections import deque
 from pathlib import Path
-from rembg import remove
-from PIL import Image
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from rembg import new_session, remove
+from PIL import Image, ImageDraw
+
+
+# Named hole colors as (r, g, b)
+HOLE_COLORS = {
+    'black': (0, 0, 0),
+    'red': (255, 0, 0),
+    'blue': (0, 0, 255),
+    'green': (0, 255, 0),
+    'yellow': (255, 255, 0),
+    'purple': (128, 0, 128),
+    'orange': (255, 165, 0),
+    'pink': (255, 192, 203),
+    'cyan': (0, 255, 255),
+}
+
+# Hex hole colors: exactly '#RRGGBB'
+HEX_COLOR_RE = re.compile(r'#([0-9a-fA-F]{6})')
+
+# Hardware H.264 encoders in order of preference, with speed-oriented presets and a
+# constant-quality target close to libx264's default CRF 23 (VideoToolbox: a fixed bitrate).
+# NVENC only targets -cq when the bitrate is left unconstrained (-b:v 0).
+HW_ENCODERS = {
+    'h264_nvenc': ['-preset', 'p4', '-tune', 'hq', '-rc', 'vbr', '-cq', '23', '-b:v', '0'],
+    'h264_videotoolbox': ['-b:v', '8M'],
+    'h264_qsv': ['-preset', 'veryfast', '-global_quality', '23'],
+}
+
+# libx264 speed presets, fastest first
+X264_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast',
+                'medium', 'slow', 'slower', 'veryslow')
+
+# Hardware decoders on the same device as each encoder, for the background video
+HW_DECODERS = {
+    'h264_nvenc': 'cuda',
+    'h264_videotoolbox': 'videotoolbox',
+}
+
+# Lines from the end of FFmpeg's log shown when a command fails
+FFMPEG_ERROR_LOG_LINES = 50
+
+# Shortest time range worth rendering in its own FFmpeg process
+MIN_SEGMENT_SECONDS = 2
+
+# Rotation angles are rounded to this step so the piece sprite sheet holds at most 120 sprites
+ROTATION_STEP_DEGREES = 3
+
+# Largest piece sprite sheet (in pixels, 4 bytes each); coarser angle steps are used beyond it
+MAX_SPRITE_SHEET_PIXELS = 64 * 1024 * 1024
+
+# Background removal model; u2netp is much smaller and faster than the default u2net
+REMBG_MODEL = 'u2netp'
+
+# Optional ONNX model file (e.g. an INT8-quantized U2-Net) to use instead of REMBG_MODEL
+REMBG_MODEL_PATH = os.environ.get('REMBG_MODEL_PATH')
+
+# On-disk cache of background-removed images, keyed by image content and model
+REMBG_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'puzzle_video' / 'no_bg'
+
+# rembg session shared by every generator in this process (loading the model is expensive)
+_REMBG_SESSION = None
+
+# CPUs a generator may use; parallel batch workers each get an equal share
+_CPU_BUDGET = None
+
+
+@lru_cache(maxsize=None)
+def _detect_hw_encoder():
+    """Return the first hardware H.264 encoder that actually works, or None."""
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    available = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1}
+    for encoder in HW_ENCODERS:
+        if encoder not in available:
+            continue
+        # Being compiled in does not mean the hardware is present, so do a tiny test encode
+        test = subprocess.run([
+            'ffmpeg', '-hide_banner', '-v', 'error',
+            '-f', 'lavfi', '-i', 'color=c=black:s=256x256:d=0.1',
+            '-frames:v', '1', '-pix_fmt', 'yuv420p', '-c:v', encoder,
+            '-f', 'null', '-'
+        ], capture_output=True, text=True)
+        if test.returncode == 0:
+            return encoder
+    return None
+
+
+def _cpu_count():
+    """Return the number of CPUs this process should keep busy."""
+    return _CPU_BUDGET or os.cpu_count() or 1
+
+
+def _init_batch_worker(cpu_budget):
+    """Limit a batch worker process to its share of the CPUs."""
+    global _CPU_BUDGET
+    _CPU_BUDGET = cpu_budget
+
+
+def _get_rembg_session():
+    """Return the shared rembg session, creating it on first use."""
+    global _REMBG_SESSION
+    if _REMBG_SESSION is None:
+        # rembg picks the best onnxruntime provider available (CUDA, CoreML, CPU)
+        if REMBG_MODEL_PATH:
+            _REMBG_SESSION = new_session('u2net_custom', model_path=REMBG_MODEL_PATH)
+        else:
+            _REMBG_SESSION = new_session(REMBG_MODEL)
+    return _REMBG_SESSION
+
+
+def _file_version(path):
+    """Return (absolute path, mtime, size) identifying the current contents of a file for caching."""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+@lru_cache(maxsize=32)
+def _probe_video_file(path, mtime_ns, size):
+    """Read (width, height, duration) of a video with one FFprobe call, cached per file version."""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height:format=duration',
+        '-of', 'json',
+        path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        info = json.loads(result.stdout)
+        stream = info['streams'][0]
+        width, height = int(stream['width']), int(stream['height'])
+        duration = float(info['format']['duration'])
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to read background video: {e.stderr}")
+    except (KeyError, IndexError, ValueError) as e:
+        raise RuntimeError(f"Invalid video file: cannot read {e}")
+
+    if width <= 0 or height <= 0:
+        raise RuntimeError(f"Invalid video dimensions: {width}x{height}")
+    if duration <= 0:
+        raise RuntimeError(f"Invalid video duration: {duration}")
+
+    return width, height, duration
+
+
+@lru_cache(maxsize=32)
+def _probe_audio_duration_file(path, mtime_ns, size):
+    """Read the duration of an audio file with FFprobe, cached per file version."""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        duration = float(result.stdout.strip())
+        if duration <= 0:
+            raise ValueError(f"Invalid audio duration: {duration}")
+        return duration
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to read audio duration: {e.stderr}")
+    except ValueError as e:
+        raise RuntimeError(f"Invalid audio file or duration: {e}")
+
+
+@lru_cache(maxsize=8)
+def _remove_background_cached(path, mtime_ns, size):
+    """
+    Run rembg on an image file, cached per file version in memory and per
+    file content (and model) on disk, so repeated runs skip the model.
+
+    The returned RGBA image is shared between callers and must not be modified.
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.blake2b(f.read(), digest_size=16)
+    digest.update((REMBG_MODEL_PATH or REMBG_MODEL).encode())
+    cache_file = REMBG_CACHE_DIR / f"{digest.hexdigest()}.png"
+
+    try:
+        with Image.open(cache_file) as cached:
+            return cached.convert('RGBA')
+    except OSError:
+        pass  # Not cached yet (or unreadable): run the model
+
+    with Image.open(path) as input_img:
+        output_img = remove(input_img, session=_get_rembg_session()).convert('RGBA')
+
+    # Write under a unique name and rename, so parallel runs never see a partial file
+    temp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        REMBG_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        output_img.save(temp_file, format='PNG', compress_level=1)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        try:
+            temp_file.unlink()
+        except OSError:
+            pass
+        print(f"   ⚠️  Warning: Could not cache background removal result: {e}")
+
+    return output_img
 
 
 class PuzzleVideoGenerator:
@@ -42,7 +255,7 @@ class PuzzleVideoGenerator:
             if audio_file:
                 self.duration = self._get_audio_duration()
             else:
-                self.duration = self._get_video_duration()
+                _, _, self.duration = self._probe_video()
         else:
             self.duration = duration
 
@@ -50,9 +263,46 @@ class PuzzleVideoGenerator:
         self.duration = min(self.duration, 12)
 
         # Use ceil to ensure we cover the full duration without gaps
-        import math
         self.total_frames = math.ceil(self.duration * fps)
 
+    @classmethod
+    def process_batch(cls, jobs, workers=1):
+        """
+        Generate several videos.
+
+        The rembg session, hardware encoder probe, video and audio probes and
+        background-removed images are cached at module level, so jobs that share
+        inputs (and run in the same process) only pay for them once.
+
+        Args:
+            jobs: Iterable of dicts holding the constructor arguments (input_image,
+                  background_video, output_path, and optionally audio_file,
+                  duration, fps) plus any generate_puzzle_video keyword arguments
+            workers: Number of worker processes (default: 1, run in this process).
+                     Each worker loads its own rembg model and gets an equal share
+                     of the CPUs for FFmpeg.
+
+        Returns:
+            List of output paths, in job order
+        """
+        jobs = list(jobs)
+        if workers > 1 and len(jobs) > 1:
+            workers = min(workers, len(jobs))
+            cpu_budget = max(1, (os.cpu_count() or 1) // workers)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                     initargs=(cpu_budget,)) as executor:
+                return list(executor.map(cls._run_job, jobs))
+
+        return [cls._run_job(job) for job in jobs]
+
+    @classmethod
+    def _run_job(cls, job):
+        """Generate the video described by one process_batch job and return its output path."""
+        init_keys = {'input_image', 'background_video', 'output_path', 'audio_file', 'duration', 'fps'}
+        generator = cls(**{key: value for key, value in job.items() if key in init_keys})
+        generator.generate_puzzle_video(**{key: value for key, value in job.items() if key not in init_keys})
+        return generator.output_path
+
     def _validate_inputs(self, input_image, background_video, output_path, fps, audio_file):
         """Validate all input parameters."""
         # Check if input image exists
@@ -96,7 +346,8 @@ class PuzzleVideoGenerator:
                             hole_color='red', piece_scale=1.0,
                             cut_margin_top=10,
                             audio_volume=100, audio_custom_volume=100,
-                            alignment_hold_time=0.5, image_coverage=80):
+                            alignment_hold_time=0.5, image_coverage=80,
+                            encoder_preset='fast'):
         """
         Generate the puzzle video.
 
@@ -105,13 +356,14 @@ class PuzzleVideoGenerator:
             num_alignments: Number of times the piece aligns correctly (default: None, random 3-5)
             cut_shape: Shape of cut ('circle', 'square', 'triangle', 'star', 'random')
             movement_style: Movement style (currently uses linear vertical)
-            hole_color: Color of the hole ('red', 'black', 'blue', 'green', 'yellow', 'random', or hex like '#FF0000')
+            hole_color: Color of the hole ('red', 'black', 'blue', 'green', 'yellow', 'random', or hex exactly '#RRGGBB' like '#FF0000')
             piece_scale: Scale multiplier for cut piece size (default: 1.0, range: 0.5-2.0)
             cut_margin_top: Top margin % to avoid cutting from (default: 10). Cut will be horizontally centered and positioned immediately after the top margin.
             audio_volume: Background video audio volume % (default: 100, range: 0-200)
             audio_custom_volume: Custom audio file volume % (default: 100, range: 0-200)
             alignment_hold_time: Number of frames to hold piece at aligned position (default: 0.5 for backward compatibility, range: 0-90)
             image_coverage: Percentage of video that image should cover (default: 80, range: 50-95)
+            encoder_preset: libx264 preset (default: 'fast'; 'veryfast'/'ultrafast' for quick drafts)
         """
         # Validate parameters
         if cut_percentage <= 0 or cut_percentage > 50:
@@ -147,6 +399,9 @@ class PuzzleVideoGenerator:
         if image_coverage < 50 or image_coverage > 95:
             raise ValueError(f"image_coverage must be between 50 and 95, got: {image_coverage}")
 
+        if encoder_preset not in X264_PRESETS:
+            raise ValueError(f"encoder_preset must be one of {list(X264_PRESETS)}, got: {encoder_preset}")
+
         # Validate cut margin
         if cut_margin_top < 0 or cut_margin_top > 90:
             raise ValueError(f"cut_margin_top must be between 0 and 90, got: {cut_margin_top}")
@@ -154,6 +409,7 @@ class PuzzleVideoGenerator:
         # Handle random hole color
         if hole_color == 'random':
             hole_color = random.choice(['red', 'blue', 'green', 'yellow', 'purple', 'orange', 'pink', 'cyan'])
+        self._parse_hole_color(hole_color)  # Reject malformed hex colors before any rendering work
 
         # Random alignments if not specified (3-5 for slower movement)
         if num_alignments is None:
@@ -176,7 +432,7 @@ class PuzzleVideoGenerator:
         print(f"   Alignment hold: {alignment_hold_time} frames")
 
         # Get background video dimensions
-        bg_width, bg_height = self._get_video_dimensions()
+        bg_width, bg_height, _ = self._probe_video()
         print(f"   Background size: {bg_width}x{bg_height}")
 
         # Get image dimensions
@@ -252,362 +508,203 @@ class PuzzleVideoGenerator:
         print(f"   Cut piece: {cut_size}x{cut_size} at ({cut_x_on_img}, {cut_y_on_img}) on image")
         print(f"   Alignment position on video: ({align_x}, {align_y})")
 
-        # Generate alignment frames
-        alignment_frames = self._generate_alignment_frames(num_alignments)
-        print(f"   Alignment frames: {alignment_frames}")
+        # Background removal is by far the slowest step; run it, and warm the
+        # encoder probe, while the piece's path is planned
+        print("   🎨 Removing background from image...")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            no_bg_future = executor.submit(self._remove_background)
+            executor.submit(_detect_hw_encoder)
+
+            # Generate alignment frames
+            alignment_frames = self._generate_alignment_frames(num_alignments)
+            print(f"   Alignment frames: {alignment_frames}")
+
+            # Generate movement keyframes
+            keyframes = self._generate_movement_keyframes(
+                bg_width, bg_height, cut_size, align_x, align_y,
+                alignment_frames, movement_style, alignment_hold_time
+            )
 
-        # Create temporary directory
-        temp_dir = Path(self.output_path).parent / "temp_frames"
-        temp_dir.mkdir(exist_ok=True)
+            # Resample keyframes to one position per frame (handed to FFmpeg via sendcmd)
+            trajectory = self._build_trajectory(keyframes)
 
-        # Remove background from image using rembg
-        print("   🎨 Removing background from image...")
-        no_bg_image = str(temp_dir / "no_bg.png")
-        self._remove_background(no_bg_image)
+            # Render the shape mask once; it is shared by the hole and the piece
+            shape_mask = self._create_shape_mask(cut_shape, cut_size)
 
-        # Create scaled main image with hole
-        main_image_with_hole = str(temp_dir / "main_image_hole.png")
-        self._create_main_image_with_hole(no_bg_image, scaled_img_width, scaled_img_height,
-                                          cut_x_on_img, cut_y_on_img, cut_size,
-                                          main_image_with_hole, cut_shape, hole_color)
+            no_bg_image = no_bg_future.result()
 
-        # Extract the cut piece
-        cut_piece = str(temp_dir / "cut_piece.png")
-        self._extract_cut_piece_from_image(no_bg_image, cut_x_on_img, cut_y_on_img, cut_size,
-                                           scaled_img_width, scaled_img_height,
-                                           cut_piece, cut_shape)
-
-        # Generate movement keyframes
-        keyframes = self._generate_movement_keyframes(
-            bg_width, bg_height, cut_size, align_x, align_y,
-            alignment_frames, movement_style, alignment_hold_time
-        )
+        # Scale once with Pillow; the hole and the piece are both cut from this image
+        scaled_image = no_bg_image.resize((scaled_img_width, scaled_img_height), Image.LANCZOS)
+
+        # Create main image with hole (kept in memory, streamed to FFmpeg as raw RGBA)
+        print("   ✂️  Creating hole in main image...")
+        main_image = self._create_main_image_with_hole(scaled_image, cut_x_on_img, cut_y_on_img,
+                                                       shape_mask, hole_color)
+
+        # Only the rotating style ever turns the piece away from 0 degrees
+        rotates = bool((np.round(trajectory[:, 2]) % 360).any())
 
-        # Create the video with FFmpeg
-        self._create_video_ffmpeg(main_image_with_hole, cut_piece, keyframes,
-                                 img_x, img_y, audio_volume, audio_custom_volume)
+        # Pad the piece once to a fixed square canvas that fits it at any rotation
+        rotation_pad = math.ceil(cut_size * (math.sqrt(2) - 1) / 2) if rotates else 0
 
-        # Cleanup
-        import shutil
-        shutil.rmtree(temp_dir)
+        # Extract the cut piece
+        print("   🧩 Extracting puzzle piece...")
+        cut_piece = self._extract_cut_piece(scaled_image, cut_x_on_img, cut_y_on_img, cut_shape,
+                                            shape_mask, rotation_pad)
+
+        # Positions refer to the padded canvas, so shift them to keep the piece itself in place
+        trajectory[:, :2] -= rotation_pad
+
+        # Temporary directory in RAM (tmpfs) where available, removed even if rendering fails
+        with tempfile.TemporaryDirectory(prefix='puzzle_video_',
+                                         dir='/dev/shm' if os.path.isdir('/dev/shm') else None) as temp_name:
+            temp_dir = Path(temp_name)
+
+            piece_sprites = str(temp_dir / "piece_sprites.png")
+            if rotates:
+                # Pre-rotate the piece in Pillow; FFmpeg only crops the right sprite for each frame
+                sprite_offsets = self._create_rotation_sprites(cut_piece, trajectory[:, 2], piece_sprites)
+                # Per frame: piece x, y and the sprite's x, y on the sheet
+                motion = np.column_stack((trajectory[:, :2], sprite_offsets))
+            else:
+                # A single upright sprite: no sheet to crop, so the crop stage is left out of the graph
+                cut_piece.save(piece_sprites, compress_level=1)
+                motion = trajectory[:, :2]
+
+            # Create the video with FFmpeg
+            self._create_video_ffmpeg(main_image, piece_sprites, cut_piece.width, motion, temp_dir,
+                                     img_x, img_y, audio_volume, audio_custom_volume, encoder_preset)
 
         print(f"✅ Video created: {self.output_path}")
 
-    def _get_video_duration(self):
-        """Get background video duration using FFprobe."""
-        cmd = [
-            'ffprobe', '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            self.background_video
-        ]
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            duration = float(result.stdout.strip())
-            if duration <= 0:
-                raise ValueError(f"Invalid video duration: {duration}")
-            return duration
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Failed to read video duration: {e.stderr}")
-        except ValueError as e:
-            raise RuntimeError(f"Invalid video file or duration: {e}")
+    def _probe_video(self):
+        """Get background video width, height and duration with a single FFprobe call (cached)."""
+        return _probe_video_file(*_file_version(self.background_video))
 
     def _get_audio_duration(self):
-        """Get audio file duration using FFprobe."""
-        cmd = [
-            'ffprobe', '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            self.audio_file
-        ]
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            duration = float(result.stdout.strip())
-            if duration <= 0:
-                raise ValueError(f"Invalid audio duration: {duration}")
-            return duration
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Failed to read audio duration: {e.stderr}")
-        except ValueError as e:
-            raise RuntimeError(f"Invalid audio file or duration: {e}")
-
-    def _get_video_dimensions(self):
-        """Get background video dimensions using FFprobe."""
-        cmd = [
-            'ffprobe', '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height',
-            '-of', 'csv=p=0',
-            self.background_video
-        ]
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            width, height = map(int, result.stdout.strip().split(','))
-            if width <= 0 or height <= 0:
-                raise ValueError(f"Invalid dimensions: {width}x{height}")
-            return width, height
-        except (subprocess.CalledProcessError, ValueError) as e:
-            raise RuntimeError(f"Failed to read video dimensions: {e}")
+        """Get audio file duration using FFprobe (cached)."""
+        return _probe_audio_duration_file(*_file_version(self.audio_file))
 
     def _get_image_dimensions(self):
-        """Get image dimensions using FFprobe."""
-        cmd = [
-            'ffprobe', '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height',
-            '-of', 'csv=p=0',
-            self.input_image
-        ]
+        """Get image dimensions from the file header using Pillow."""
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            width, height = map(int, result.stdout.strip().split(','))
-            if width <= 0 or height <= 0:
-                raise ValueError(f"Invalid dimensions: {width}x{height}")
-            return width, height
-        except (subprocess.CalledProcessError, ValueError) as e:
+            with Image.open(self.input_image) as img:
+                width, height = img.size
+        except OSError as e:
             raise RuntimeError(f"Failed to read image dimensions: {e}")
+        if width <= 0 or height <= 0:
+            raise RuntimeError(f"Invalid image dimensions: {width}x{height}")
+        return width, height
+
+    def _remove_background(self):
+        """Remove background from input image using rembg and return it as an RGBA image."""
+        # An image that already has transparency has been cut out; skip the model entirely
+        with Image.open(self.input_image) as img:
+            if img.mode in ('RGBA', 'LA') and img.getextrema()[-1][0] < 255:
+                print("   Image already has transparency, skipping background removal")
+                return img.convert('RGBA')
 
-    def _remove_background(self, output_path):
-        """Remove background from input image using rembg."""
         try:
-            # Open the input image
-            input_img = Image.open(self.input_image)
-
-            # Remove background
-            output_img = remove(input_img)
-
-            # Save the result
-            output_img.save(output_path)
+            # Cached per file version, so repeated runs on the same image skip the model
+            output_img = _remove_background_cached(*_file_version(self.input_image))
         except Exception as e:
             print(f"   ⚠️  Warning: Background removal failed: {e}")
             print("   Continuing with original image...")
-            # If rembg fails, just copy the original image
-            import shutil
-            shutil.copy(self.input_image, output_path)
-
-    def _create_main_image_with_hole(self, source_image, width, height, cut_x, cut_y, cut_size, output, shape, hole_color):
-        """Create scaled main image with colored hole where piece was cut."""
-
-        # Convert color name to RGB values for geq filter
-        color_map = {
-            'black': (0, 0, 0),
-            'red': (255, 0, 0),
-            'blue': (0, 0, 255),
-            'green': (0, 255, 0),
-            'yellow': (255, 255, 0),
-            'purple': (128, 0, 128),
-            'orange': (255, 165, 0),
-            'pink': (255, 192, 203),
-            'cyan': (0, 255, 255)
-        }
+            # If rembg fails, just use the original image
+            output_img = Image.open(self.input_image).convert('RGBA')
 
-        # Handle hex colors or use color map
-        if hole_color.startswith('#'):
-            # Parse hex color
-            hex_color = hole_color.lstrip('#')
-            r, g, b = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        else:
-            r, g, b = color_map.get(hole_color.lower(), (255, 0, 0))  # Default to red
-
-        # Scale image (already has background removed) and add hole
-        if shape == 'square':
-            # Square hole using drawbox
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={width}:{height},"
-                       f"drawbox=x={cut_x}:y={cut_y}:w={cut_size}:h={cut_size}:color={hole_color}:t=fill",
-                output
-            ]
-        elif shape == 'circle':
-            # Circle hole using geq
-            radius = cut_size // 2
-            center_x = cut_x + radius
-            center_y = cut_y + radius
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={width}:{height},"
-                       f"format=rgba,"
-                       f"geq=r='if(lt(hypot(X-{center_x},Y-{center_y}),{radius}),{r},r(X,Y))':"
-                       f"g='if(lt(hypot(X-{center_x},Y-{center_y}),{radius}),{g},g(X,Y))':"
-                       f"b='if(lt(hypot(X-{center_x},Y-{center_y}),{radius}),{b},b(X,Y))':"
-                       f"a='if(lt(hypot(X-{center_x},Y-{center_y}),{radius}),255,alpha(X,Y))'",
-                output
-            ]
-        elif shape == 'diamond':
-            # Diamond hole
-            cx = cut_x + cut_size // 2
-            cy = cut_y + cut_size // 2
-            translated_expr = f"lt(abs(X-{cx})+abs(Y-{cy}),{cut_size//2})"
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={width}:{height},"
-                       f"format=rgba,"
-                       f"geq=r='if({translated_expr},{r},r(X,Y))':"
-                       f"g='if({translated_expr},{g},g(X,Y))':"
-                       f"b='if({translated_expr},{b},b(X,Y))':"
-                       f"a='if({translated_expr},255,alpha(X,Y))'",
-                output
-            ]
-        elif shape == 'hexagon':
-            # Hexagon hole
-            cx = cut_x + cut_size // 2
-            cy = cut_y + cut_size // 2
-            rad = cut_size // 2
-            translated_expr = f"lt(max(abs(X-{cx}),abs(Y-{cy}))*1.2+min(abs(X-{cx}),abs(Y-{cy}))*0.4,{rad})"
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={width}:{height},"
-                       f"format=rgba,"
-                       f"geq=r='if({translated_expr},{r},r(X,Y))':"
-                       f"g='if({translated_expr},{g},g(X,Y))':"
-                       f"b='if({translated_expr},{b},b(X,Y))':"
-                       f"a='if({translated_expr},255,alpha(X,Y))'",
-                output
-            ]
-        elif shape == 'oval':
-            # Oval hole
-            cx = cut_x + cut_size // 2
-            cy = cut_y + cut_size // 2
-            rx = cut_size // 2
-            ry = cut_size // 3
-            translated_expr = f"lt(pow((X-{cx})/{rx},2)+pow((Y-{cy})/{ry},2),1)"
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={width}:{height},"
-                       f"format=rgba,"
-                       f"geq=r='if({translated_expr},{r},r(X,Y))':"
-                       f"g='if({translated_expr},{g},g(X,Y))':"
-                       f"b='if({translated_expr},{b},b(X,Y))':"
-                       f"a='if({translated_expr},255,alpha(X,Y))'",
-                output
-            ]
-        else:
-            # Fallback to square
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={width}:{height},"
-                       f"drawbox=x={cut_x}:y={cut_y}:w={cut_size}:h={cut_size}:color={hole_color}:t=fill",
-                output
-            ]
-
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Error creating main image with hole: {result.stderr}")
-            raise RuntimeError(f"FFmpeg failed to create main image with hole")
-
-    def _extract_cut_piece_from_image(self, source_image, cut_x, cut_y, cut_size, img_width, img_height, output, shape):
-        """Extract the cut piece from the scaled image (background already removed)."""
-
-        if shape == 'square':
-            # Simple square crop (no mask needed)
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={img_width}:{img_height},"
-                       f"crop={cut_size}:{cut_size}:{cut_x}:{cut_y}",
-                output
-            ]
-        elif shape == 'circle':
-            # Circle mask
-            radius = cut_size // 2
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={img_width}:{img_height},"
-                       f"crop={cut_size}:{cut_size}:{cut_x}:{cut_y},"
-                       f"format=rgba,"
-                       f"geq=r='r(X,Y)':g='g(X,Y)':b='b(X,Y)':"
-                       f"a='if(lt(hypot(X-{radius},Y-{radius}),{radius}),255,0)'",
-                output
-            ]
+        return output_img
+
+    def _create_shape_mask(self, shape, size):
+        """Render the cut shape as a size x size grayscale mask (255 inside the shape)."""
+        mask = Image.new('L', (size, size), 0)
+        draw = ImageDraw.Draw(mask)
+        cx, cy = size // 2, size // 2
+        r = size // 2
+
+        if shape == 'circle':
+            draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=255)
         elif shape == 'diamond':
-            # Diamond/rhombus mask
-            cx, cy = cut_size // 2, cut_size // 2
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={img_width}:{img_height},"
-                       f"crop={cut_size}:{cut_size}:{cut_x}:{cut_y},"
-                       f"format=rgba,"
-                       f"geq=r='r(X,Y)':g='g(X,Y)':b='b(X,Y)':"
-                       f"a='if(lt(abs(X-{cx})+abs(Y-{cy}),{cx}),255,0)'",
-                output
-            ]
+            draw.polygon([(cx, cy - r), (cx + r, cy), (cx, cy + r), (cx - r, cy)], fill=255)
         elif shape == 'hexagon':
-            # Hexagon mask (simplified octagon-like)
-            cx, cy = cut_size // 2, cut_size // 2
-            r = cut_size // 2
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={img_width}:{img_height},"
-                       f"crop={cut_size}:{cut_size}:{cut_x}:{cut_y},"
-                       f"format=rgba,"
-                       f"geq=r='r(X,Y)':g='g(X,Y)':b='b(X,Y)':"
-                       f"a='if(lt(max(abs(X-{cx}),abs(Y-{cy}))*1.2+min(abs(X-{cx}),abs(Y-{cy}))*0.4,{r}),255,0)'",
-                output
-            ]
+            # Same outline as max(|dx|,|dy|)*1.2 + min(|dx|,|dy|)*0.4 < r (octagon-like)
+            a, d = r / 1.2, r / 1.6
+            draw.polygon([(cx + a, cy), (cx + d, cy + d), (cx, cy + a), (cx - d, cy + d),
+                          (cx - a, cy), (cx - d, cy - d), (cx, cy - a), (cx + d, cy - d)], fill=255)
         elif shape == 'oval':
-            # Oval/ellipse mask
-            cx, cy = cut_size // 2, cut_size // 2
-            rx, ry = cut_size // 2, cut_size // 3  # Wider than tall
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={img_width}:{img_height},"
-                       f"crop={cut_size}:{cut_size}:{cut_x}:{cut_y},"
-                       f"format=rgba,"
-                       f"geq=r='r(X,Y)':g='g(X,Y)':b='b(X,Y)':"
-                       f"a='if(lt(pow((X-{cx})/{rx},2)+pow((Y-{cy})/{ry},2),1),255,0)'",
-                output
-            ]
+            rx, ry = size // 2, size // 3  # Wider than tall
+            draw.ellipse([cx - rx, cy - ry, cx + rx, cy + ry], fill=255)
         else:
-            # Fallback to square
-            cmd = [
-                'ffmpeg', '-y', '-i', source_image,
-                '-vf', f"scale={img_width}:{img_height},"
-                       f"crop={cut_size}:{cut_size}:{cut_x}:{cut_y}",
-                output
-            ]
-
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Error extracting cut piece: {result.stderr}")
-            raise RuntimeError(f"FFmpeg failed to extract cut piece")
-
-    def _get_polygon_mask_expr(self, shape, size):
-        """Generate FFmpeg geq expression for polygon shapes (centered in size x size box)."""
-        cx, cy = size // 2, size // 2  # Center point
-
-        if shape == 'triangle':
-            # Equilateral triangle pointing up
-            # Point is at top, base at bottom
-            h = size // 2  # Half height
-            return f"gte(Y-{cy},-{h})*lte(Y-{cy},{h})*lte(abs(X-{cx}),(Y-{cy}+{h})*0.577)"  # 0.577 = 1/1.732
-
-        elif shape == 'oval':
-            # Ellipse (wider horizontally)
-            a = size // 2  # Horizontal radius
-            b = size // 2.5  # Vertical radius (smaller for oval)
-            return f"lte(pow((X-{cx})/{a},2)+pow((Y-{cy})/{b},2),1)"
+            # Square (and fallback) covers the whole box
+            draw.rectangle([0, 0, size - 1, size - 1], fill=255)
 
-        elif shape == 'hexagon':
-            # Regular hexagon
-            h = size // 2
-            return f"lte(abs(X-{cx}),{h}*0.866)*lte(abs((Y-{cy})-tan(PI/6)*(X-{cx})),{h})*lte(abs((Y-{cy})+tan(PI/6)*(X-{cx})),{h})"
-
-        elif shape == 'pentagon':
-            # Regular pentagon (approximate using angle check)
-            r = size // 2
-            return f"lte(hypot(X-{cx},Y-{cy}),{r}*(1-0.15*abs(sin(5*atan2(Y-{cy},X-{cx})))))"
-
-        elif shape == 'octagon':
-            # Regular octagon
-            r = size // 2
-            return f"lte(max(abs(X-{cx}),abs(Y-{cy}))+0.414*min(abs(X-{cx}),abs(Y-{cy})),{r})"
-
-        elif shape == 'diamond':
-            # Diamond/Rhombus
-            return f"lte(abs(X-{cx})+abs(Y-{cy}),{size//2})"
+        return mask
 
-        else:
-            # Fallback to circle
-            return f"hypot(X-{cx},Y-{cy})<{size//2}"
+    def _parse_hole_color(self, hole_color):
+        """Convert a color name or hex string to an (r, g, b) tuple."""
+        # Handle hex colors or use color map
+        if hole_color.startswith('#'):
+            # Parse hex color
+            match = HEX_COLOR_RE.fullmatch(hole_color)
+            if match is None:
+                raise ValueError(f"Invalid hex color: {hole_color}. Expected #RRGGBB")
+            return tuple(bytes.fromhex(match.group(1)))
+        return HOLE_COLORS.get(hole_color.lower(), (255, 0, 0))  # Default to red
+
+    def _create_main_image_with_hole(self, scaled_image, cut_x, cut_y, shape_mask, hole_color):
+        """Return a copy of the scaled image with the cut shape filled in the hole color."""
+        main_image = scaled_image.copy()
+        hole = Image.new('RGBA', shape_mask.size, (*self._parse_hole_color(hole_color), 255))
+        main_image.paste(hole, (cut_x, cut_y), shape_mask)
+        return main_image
+
+    def _extract_cut_piece(self, scaled_image, cut_x, cut_y, shape, shape_mask, rotation_pad):
+        """
+        Cut the piece out of the scaled image and return it centered on a
+        transparent canvas with rotation_pad pixels on every side, so it fits
+        at any angle.
+        """
+        size = shape_mask.width
+        piece = scaled_image.crop((cut_x, cut_y, cut_x + size, cut_y + size))
+        if shape != 'square':
+            # Use the shape mask as the piece's alpha channel (square keeps the image's own alpha)
+            piece.putalpha(shape_mask)
+
+        canvas_size = size + 2 * rotation_pad
+        canvas = Image.new('RGBA', (canvas_size, canvas_size), (0, 0, 0, 0))
+        canvas.paste(piece, (rotation_pad, rotation_pad))
+        return canvas
+
+    def _create_rotation_sprites(self, piece, rotations, output):
+        """
+        Save the piece at every angle used by `rotations` (rounded to
+        ROTATION_STEP_DEGREES) as a grid of sprites, and return the (x, y)
+        offset of each frame's sprite.
+        """
+        size = piece.width
+        step = ROTATION_STEP_DEGREES
+        while True:
+            angles = (np.round(rotations / step) * step).astype(np.int64) % 360
+            used_angles, sprite_index = np.unique(angles, return_inverse=True)
+            columns = math.ceil(math.sqrt(len(used_angles)))
+            rows = math.ceil(len(used_angles) / columns)
+            if columns * rows * size * size <= MAX_SPRITE_SHEET_PIXELS or len(used_angles) == 1:
+                break
+            step += 1  # Very large piece: trade angle precision for a sheet that fits in memory
+
+        sheet = Image.new('RGBA', (columns * size, rows * size), (0, 0, 0, 0))
+
+        # Rotate premultiplied so transparent pixels don't darken the edges
+        premultiplied = piece.convert('RGBa')
+        for i, angle in enumerate(used_angles.tolist()):
+            # Positive angles turn clockwise (as FFmpeg's rotate did); Pillow turns counter-clockwise
+            sprite = premultiplied.rotate(-angle, resample=Image.BILINEAR) if angle else premultiplied
+            sheet.paste(sprite.convert('RGBA'), ((i % columns) * size, (i // columns) * size))
+
+        # Written once and decoded once per render; favor speed over file size
+        sheet.save(output, compress_level=1)
+
+        return np.column_stack((sprite_index % columns, sprite_index // columns)) * size
 
     def _generate_alignment_frames(self, num_alignments):
         """Generate frame numbers where the piece should align."""
@@ -687,6 +784,12 @@ class PuzzleVideoGenerator:
         total_segments = num_alignments + 1
         frames_per_segment = self.total_frames // total_segments
 
+        # Hold period: piece stays at alignment (alignment_hold_time is now in frames)
+        hold_frames = max(int(alignment_hold_time), 1)  # At least 1 frame
+        # Add approach keyframe before alignment to slow down (reduced for faster movement)
+        # Use fewer approach frames for short holds
+        approach_frames = min(3, max(1, hold_frames // 3))
+
         for i in range(num_alignments + 1):
             going_down = i % 2 == 0
             sweep_x = random.randint(0, width - size)
@@ -722,12 +825,6 @@ class PuzzleVideoGenerator:
             # Alignment (if this segment has one)
             if i < num_alignments:
                 alignment_frame = alignment_frames[i]
-                # Hold period: piece stays at alignment (alignment_hold_time is now in frames)
-                hold_frames = max(int(alignment_hold_time), 1)  # At least 1 frame
-
-                # Add approach keyframe before alignment to slow down (reduced for faster movement)
-                # Use fewer approach frames for short holds
-                approach_frames = min(3, max(1, hold_frames // 3))
                 if alignment_frame > approach_frames:
                     keyframes.append({
                         'frame': alignment_frame - approach_frames,
@@ -780,6 +877,10 @@ class PuzzleVideoGenerator:
         current_frame = 0
         current_rotation = 0
 
+        # Hold and approach lengths are the same for every alignment
+        hold_frames = max(int(alignment_hold_time), 1)
+        approach_frames = min(3, max(1, hold_frames // 3))
+
         for i in range(num_alignments):
             # Random position with rotation
             keyframes.append({
@@ -789,12 +890,8 @@ class PuzzleVideoGenerator:
                 'rotation': current_rotation
             })
 
-            # Alignment (no rotation when aligned)
+            # Alignment (no rotation when aligned), with an approach keyframe to slow down before it
             alignment_frame = alignment_frames[i]
-            hold_frames = max(int(alignment_hold_time), 1)
-
-            # Add approach keyframe to slow down before alignment
-            approach_frames = min(3, max(1, hold_frames // 3))
             if alignment_frame > approach_frames:
                 keyframes.append({
                     'frame': alignment_frame - approach_frames,
@@ -839,16 +936,20 @@ class PuzzleVideoGenerator:
         frames_per_segment = self.total_frames // (num_alignments + 1) if num_alignments > 0 else self.total_frames
         current_frame = 0
 
+        # Hold and approach lengths are the same for every alignment
+        hold_frames = max(int(alignment_hold_time), 1)
+        approach_frames = min(3, max(1, hold_frames // 3))
+
+        # Zigzag pattern - visit the corners in turn
+        corners = [
+            (0, 0),  # Top-left
+            (width - size, 0),  # Top-right
+            (width - size, height - size),  # Bottom-right
+            (0, height - size),  # Bottom-left
+        ]
+
         for i in range(num_alignments):
-            # Zigzag pattern - alternate corners
-            if i % 4 == 0:
-                x, y = 0, 0  # Top-left
-            elif i % 4 == 1:
-                x, y = width - size, 0  # Top-right
-            elif i % 4 == 2:
-                x, y = width - size, height - size  # Bottom-right
-            else:
-                x, y = 0, height - size  # Bottom-left
+            x, y = corners[i % 4]
 
             keyframes.append({
                 'frame': current_frame,
@@ -857,12 +958,8 @@ class PuzzleVideoGenerator:
                 'rotation': 0
             })
 
-            # Alignment
+            # Alignment, with an approach keyframe to slow down before it
             alignment_frame = alignment_frames[i]
-            hold_frames = max(int(alignment_hold_time), 1)
-
-            # Add approach keyframe to slow down before alignment
-            approach_frames = min(3, max(1, hold_frames // 3))
             if alignment_frame > approach_frames:
                 keyframes.append({
                     'frame': alignment_frame - approach_frames,
@@ -889,15 +986,7 @@ class PuzzleVideoGenerator:
             current_frame = min(current_frame + frames_per_segment, self.total_frames - 1)
 
         # Final corner
-        final_corner = num_alignments % 4
-        if final_corner == 0:
-            x, y = 0, 0
-        elif final_corner == 1:
-            x, y = width - size, 0
-        elif final_corner == 2:
-            x, y = width - size, height - size
-        else:
-            x, y = 0, height - size
+        x, y = corners[num_alignments % 4]
 
         keyframes.append({
             'frame': self.total_frames - 1,
@@ -908,136 +997,305 @@ class PuzzleVideoGenerator:
 
         return keyframes
 
-    def _create_video_ffmpeg(self, main_image, cut_piece, keyframes, img_x, img_y, audio_volume, audio_custom_volume):
+    def _create_video_ffmpeg(self, main_image, piece_sprites, piece_size, motion, temp_dir,
+                             img_x, img_y, audio_volume, audio_custom_volume, encoder_preset):
         """Create the final video - overlay main image with hole and animated puzzle piece on background."""
 
-        # Build overlay expressions for each frame
-        x_expr = self._build_interpolation_expr(keyframes, 'x')
-        y_expr = self._build_interpolation_expr(keyframes, 'y')
+        # Prefer a hardware H.264 encoder, falling back to libx264
+        hw_encoder = _detect_hw_encoder()
+        decoder_args = []
+        if hw_encoder:
+            print(f"   Using hardware encoder: {hw_encoder}")
+            video_encoder_args = ['-c:v', hw_encoder, *HW_ENCODERS[hw_encoder]]
+            if hw_encoder in HW_DECODERS:
+                # The test encode proved the device exists; codecs it can't decode fall back to software
+                decoder_args = ['-hwaccel', HW_DECODERS[hw_encoder]]
+        else:
+            video_encoder_args = ['-c:v', 'libx264', '-preset', encoder_preset]
+            if encoder_preset in ('fast', 'medium'):
+                # Cap the rate-control lookahead (30-40 frames at these presets); the piece motion is
+                # simple. Slower presets are an explicit request for quality, so they keep theirs
+                video_encoder_args += ['-x264-params', 'rc-lookahead=20']
+
+        segments = self._plan_render_segments(hw_encoder is not None)
+
+        # The main image reaches FFmpeg as one raw RGBA frame on stdin (no PNG encode/decode)
+        main_data = main_image.tobytes()
+
+        print("🎨 Rendering video...")
+        if len(segments) > 1:
+            # Every frame depends only on its timestamp, so render time ranges in parallel and stitch them
+            print(f"   Rendering {len(segments)} segments in parallel")
+            threads = max(1, _cpu_count() // len(segments))
+            with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                futures = [
+                    executor.submit(self._render_segment, main_image, main_data, piece_sprites, piece_size,
+                                    motion, temp_dir, index, start_frame, end_frame,
+                                    img_x, img_y, video_encoder_args, threads)
+                    for index, (start_frame, end_frame) in enumerate(segments)
+                ]
+                segment_files = [future.result() for future in futures]
+            self._stitch_segments(segment_files, temp_dir, audio_volume, audio_custom_volume)
+            return
+
+        motion_commands = str(temp_dir / "piece_motion.cmd")
+        self._write_motion_commands(motion, motion_commands)
+        video_filter = self._build_video_filter(motion_commands, motion[0], piece_size,
+                                                img_x, img_y, self.duration)
+
+        # [3] = custom audio file (optional, mixed with background video audio)
+        audio_filter, audio_args = self._build_audio_args(0, 3, audio_volume, audio_custom_volume)
+        filter_complex = f"{video_filter};{audio_filter}" if audio_filter else video_filter
+
+        cmd = [
+            'ffmpeg', '-y',
+            *decoder_args,
+            '-t', str(self.duration), '-i', self.background_video,  # Input 0: background video (trimmed)
+            *self._raw_image_input_args(main_image),  # Input 1: main image with hole (raw RGBA on stdin)
+            '-framerate', str(self.fps), '-i', piece_sprites,  # Input 2: pre-rotated piece sprites
+        ]
+        if self.audio_file:
+            cmd += ['-t', str(self.duration), '-i', self.audio_file]  # Input 3: custom audio file (trimmed)
+        cmd += [
+            '-filter_complex', filter_complex,
+            '-map', '[out]',  # Map video output
+            *audio_args,
+            '-r', str(self.fps),
+            '-t', str(self.duration),  # Force output duration
+            '-pix_fmt', 'yuv420p',
+            *video_encoder_args,
+            *self._thread_args(_cpu_count()),
+            '-c:a', 'aac',  # Encode audio to AAC
+            '-b:a', '192k',  # Audio bitrate
+            self.output_path
+        ]
+
+        self._run_ffmpeg(cmd, "FFmpeg failed to render video", input_data=main_data)
+
+    def _build_video_filter(self, motion_commands, start_position, piece_size, img_x, img_y, duration):
+        """Build the video part of the filter graph, ending in [out]."""
+        # Starting position; sendcmd updates it every frame from motion_commands
+        start_x, start_y = start_position[:2]
+
+        # The sprite sheet is a single frame: repeat it so the piece overlay gets every output frame
+        piece_filter = f"[2:v]loop=loop={self.total_frames}:size=1:start=0"
+        if len(start_position) > 2:
+            # Rotating piece: crop the current angle's sprite
+            sprite_x, sprite_y = start_position[2:]
+            piece_filter += f",crop@piece={piece_size}:{piece_size}:{sprite_x:.0f}:{sprite_y:.0f}"
+
+        # FFmpeg inputs:
+        # [0] = background video
+        # [1] = main image with hole, raw RGBA on stdin
+        # [2] = pre-rotated piece sprites
+        return (
+            # Trim background video to exact duration
+            f"[0:v]trim=duration={duration},setpts=PTS-STARTPTS,"
+            f"sendcmd=f={self._escape_filter_path(motion_commands)}[bg_trimmed];"
+            # Pick the piece sprite for the current frame
+            f"{piece_filter}[rotated];"
+            # Overlay main image on background (static position)
+            f"[bg_trimmed][1:v]overlay=x={img_x}:y={img_y}:format=auto[bg_with_img];"
+            # Overlay animated piece on top
+            f"[bg_with_img][rotated]overlay@piece=x={start_x:.2f}:y={start_y:.2f}:format=auto[out]"
+        )
+
+    def _build_audio_args(self, bg_input, custom_input, audio_volume, audio_custom_volume):
+        """
+        Build the audio handling for an FFmpeg command.
 
+        Returns (filter_complex fragment, output args). The fragment is empty when
+        only the background video audio is used. Audio inputs must already be
+        limited with -t and the output capped with -t, so no atrim is needed.
+        """
         # Calculate volume multipliers (percentage to decimal)
         bg_volume_multiplier = audio_volume / 100.0
         custom_volume_multiplier = audio_custom_volume / 100.0
 
         if self.audio_file:
             # If custom audio file is provided, mix it with background video audio
-            # FFmpeg filter complex:
-            # [0] = background video
-            # [1] = main image with hole
-            # [2] = cut piece
-            # [3] = custom audio file
-            filter_complex = (
-                # Trim background video to exact duration
-                f"[0:v]trim=duration={self.duration},setpts=PTS-STARTPTS[bg_trimmed];"
-                # Format main image to ensure alpha channel is preserved
-                f"[1:v]format=rgba[main_with_alpha];"
-                # Overlay main image on background (static position)
-                f"[bg_trimmed][main_with_alpha]overlay=x={img_x}:y={img_y}:format=auto[bg_with_img];"
-                # Rotate the cut piece
-                f"[2:v]format=rgba[piece];"
-                f"[piece]rotate='{self._build_interpolation_expr(keyframes, 'rotation')}*PI/180:"
-                f"c=none:ow=max(iw,ih):oh=max(iw,ih)'[rotated];"
-                # Overlay animated piece on top
-                f"[bg_with_img][rotated]overlay=x='{x_expr}':y='{y_expr}':format=auto[out];"
-                # Trim and apply volume to background video audio
-                f"[0:a]atrim=duration={self.duration},asetpts=PTS-STARTPTS,volume={bg_volume_multiplier},apad=whole_dur={self.duration}[bg_audio];"
-                # Trim and apply volume to custom audio file
-                f"[3:a]atrim=duration={self.duration},asetpts=PTS-STARTPTS,volume={custom_volume_multiplier},apad=whole_dur={self.duration}[custom_audio];"
+            audio_filter = (
+                # Apply volume to background video audio and pad it to the full duration
+                f"[{bg_input}:a]volume={bg_volume_multiplier},apad=whole_dur={self.duration}[bg_audio];"
+                # Apply volume to custom audio file and pad it to the full duration
+                f"[{custom_input}:a]volume={custom_volume_multiplier},apad=whole_dur={self.duration}[custom_audio];"
                 # Mix both audio sources - use longest duration to prevent cutoff
-                f"[bg_audio][custom_audio]amix=inputs=2:duration=longest:dropout_transition=0,atrim=duration={self.duration}[aout]"
+                f"[bg_audio][custom_audio]amix=inputs=2:duration=longest:dropout_transition=0[aout]"
             )
+            return audio_filter, ['-map', '[aout]']  # Map mixed audio output
 
-            cmd = [
-                'ffmpeg', '-y',
-                '-t', str(self.duration), '-i', self.background_video,  # Input 0: background video (trimmed)
-                '-loop', '1', '-t', str(self.duration), '-i', main_image,  # Input 1: main image with hole
-                '-loop', '1', '-t', str(self.duration), '-i', cut_piece,   # Input 2: cut piece
-                '-t', str(self.duration), '-i', self.audio_file,  # Input 3: custom audio file (trimmed)
-                '-filter_complex', filter_complex,
-                '-map', '[out]',  # Map video output
-                '-map', '[aout]',  # Map mixed audio output
-                '-r', str(self.fps),
-                '-t', str(self.duration),  # Force output duration
-                '-pix_fmt', 'yuv420p',
-                '-c:v', 'libx264',
-                '-preset', 'fast',
-                '-c:a', 'aac',  # Encode audio to AAC
-                '-b:a', '192k',  # Audio bitrate
-                self.output_path
-            ]
-        else:
-            # No custom audio file, use only background video audio
-            # FFmpeg filter complex:
-            # [0] = background video
-            # [1] = main image with hole
-            # [2] = cut piece
-            filter_complex = (
-                # Trim background video to exact duration
-                f"[0:v]trim=duration={self.duration},setpts=PTS-STARTPTS[bg_trimmed];"
-                # Format main image to ensure alpha channel is preserved
-                f"[1:v]format=rgba[main_with_alpha];"
-                # Overlay main image on background (static position)
-                f"[bg_trimmed][main_with_alpha]overlay=x={img_x}:y={img_y}:format=auto[bg_with_img];"
-                # Rotate the cut piece
-                f"[2:v]format=rgba[piece];"
-                f"[piece]rotate='{self._build_interpolation_expr(keyframes, 'rotation')}*PI/180:"
-                f"c=none:ow=max(iw,ih):oh=max(iw,ih)'[rotated];"
-                # Overlay animated piece on top
-                f"[bg_with_img][rotated]overlay=x='{x_expr}':y='{y_expr}':format=auto[out]"
-            )
+        # No custom audio file, use only background video audio
+        return '', [
+            '-map', f'{bg_input}:a?',  # Map audio from background video if present (:a? means optional)
+            '-af', f'volume={bg_volume_multiplier},apad=whole_dur={self.duration}',  # Apply volume and pad
+        ]
 
-            cmd = [
-                'ffmpeg', '-y',
-                '-t', str(self.duration), '-i', self.background_video,  # Input 0: background video (trimmed)
-                '-loop', '1', '-t', str(self.duration), '-i', main_image,  # Input 1: main image with hole
-                '-loop', '1', '-t', str(self.duration), '-i', cut_piece,   # Input 2: cut piece
-                '-filter_complex', filter_complex,
-                '-map', '[out]',
-                '-map', '0:a?',  # Map audio from background video if present (0:a? means optional)
-                '-r', str(self.fps),
-                '-t', str(self.duration),  # Force output duration
-                '-pix_fmt', 'yuv420p',
-                '-c:v', 'libx264',
-                '-preset', 'fast',
-                '-af', f'atrim=duration={self.duration},asetpts=PTS-STARTPTS,volume={bg_volume_multiplier},apad=whole_dur={self.duration}',  # Trim, apply volume, and pad
-                '-c:a', 'aac',  # Encode audio to AAC
-                '-b:a', '192k',  # Audio bitrate
-                self.output_path
-            ]
+    def _plan_render_segments(self, use_hw_encoder):
+        """Split the output frames into contiguous [start, end) ranges that can be rendered in parallel."""
+        if use_hw_encoder:
+            # Hardware encoders only allow a few concurrent sessions and are rarely the bottleneck
+            return [(0, self.total_frames)]
 
-        print("🎨 Rendering video...")
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ FFmpeg error: {result.stderr}")
-            raise RuntimeError(f"FFmpeg failed with return code {result.returncode}")
-
-    def _build_interpolation_expr(self, keyframes, param):
-        """Build FFmpeg expression for parameter interpolation."""
-        expr_parts = []
-
-        for i in range(len(keyframes) - 1):
-            kf1 = keyframes[i]
-            kf2 = keyframes[i + 1]
-
-            t1 = kf1['frame'] / self.fps
-            t2 = kf2['frame'] / self.fps
-            v1 = kf1[param]
-            v2 = kf2[param]
-
-            # Linear interpolation formula
-            if i == 0:
-                expr_parts.append(f"if(lt(t,{t2}),{v1}+(({v2}-{v1})/({t2}-{t1}))*(t-{t1}),")
-            elif i == len(keyframes) - 2:
-                # For the last segment, continue interpolation beyond t2 to fill remaining time
-                # This ensures movement continues until the very end of the video
-                expr_parts.append(f"{v1}+(({v2}-{v1})/({t2}-{t1}))*(t-{t1})")
-            else:
-                expr_parts.append(f"if(lt(t,{t2}),{v1}+(({v2}-{v1})/({t2}-{t1}))*(t-{t1}),")
+        min_frames = max(1, int(self.fps * MIN_SEGMENT_SECONDS))
+        count = max(1, min(_cpu_count(), self.total_frames // min_frames))
+
+        # A segment cannot seek past the end of the background; the single pass
+        # instead holds the last background frame
+        if count > 1 and self._probe_video()[2] < self.duration:
+            count = 1
+
+        bounds = [self.total_frames * i // count for i in range(count + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _render_segment(self, main_image, main_data, piece_sprites, piece_size, motion, temp_dir,
+                        index, start_frame, end_frame, img_x, img_y, video_encoder_args, threads):
+        """Render frames [start_frame, end_frame) as a silent video segment and return its path."""
+        num_frames = end_frame - start_frame
+        duration = num_frames / self.fps
+
+        # Command times are relative to the segment start, matching its reset timestamps
+        motion_commands = str(temp_dir / f"piece_motion_{index}.cmd")
+        self._write_motion_commands(motion[start_frame:end_frame], motion_commands)
+        video_filter = self._build_video_filter(motion_commands, motion[start_frame], piece_size,
+                                                img_x, img_y, duration)
+
+        output = str(temp_dir / f"segment_{index}.mp4")
+        cmd = [
+            'ffmpeg', '-y',
+            '-ss', str(start_frame / self.fps), '-t', str(duration), '-i', self.background_video,
+            *self._raw_image_input_args(main_image),
+            '-framerate', str(self.fps), '-i', piece_sprites,
+            '-filter_complex', video_filter,
+            '-map', '[out]',
+            '-r', str(self.fps),
+            '-frames:v', str(num_frames),
+            '-pix_fmt', 'yuv420p',
+            *video_encoder_args,
+            *self._thread_args(threads),
+            '-an',
+            output
+        ]
+
+        self._run_ffmpeg(cmd, f"FFmpeg failed to render segment {index}", input_data=main_data)
+        return output
+
+    def _stitch_segments(self, segment_files, temp_dir, audio_volume, audio_custom_volume):
+        """Concatenate rendered segments without re-encoding and add the audio track."""
+        concat_list = temp_dir / "segments.txt"
+        with open(concat_list, 'w') as f:
+            for segment in segment_files:
+                # Paths are resolved relative to the list file
+                f.write(f"file '{Path(segment).name}'\n")
+
+        # [0] = concatenated segments, [1] = background video audio, [2] = custom audio file (optional)
+        audio_filter, audio_args = self._build_audio_args(1, 2, audio_volume, audio_custom_volume)
+
+        cmd = [
+            'ffmpeg', '-y',
+            '-f', 'concat', '-i', str(concat_list),
+            '-t', str(self.duration), '-i', self.background_video,
+        ]
+        if self.audio_file:
+            cmd += ['-t', str(self.duration), '-i', self.audio_file]
+        if audio_filter:
+            cmd += ['-filter_complex', audio_filter]
+        cmd += [
+            '-map', '0:v',
+            *audio_args,
+            '-t', str(self.duration),
+            '-c:v', 'copy',
+            '-c:a', 'aac',  # Encode audio to AAC
+            '-b:a', '192k',  # Audio bitrate
+            self.output_path
+        ]
+
+        self._run_ffmpeg(cmd, "FFmpeg failed to join video segments")
+
+    def _thread_args(self, threads):
+        """FFmpeg options that let both the encoder and the filter graph use `threads` threads."""
+        # Filters run single-threaded unless asked; overlay splits frames into slices
+        return [
+            '-threads', str(threads),
+            '-filter_threads', str(threads),
+            '-filter_complex_threads', str(threads),
+        ]
+
+    def _raw_image_input_args(self, image):
+        """FFmpeg input args that read an RGBA Pillow image as a single raw frame from stdin."""
+        width, height = image.size
+        return [
+            '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}',
+            '-framerate', str(self.fps), '-i', 'pipe:0'
+        ]
+
+    def _run_ffmpeg(self, cmd, error_message, input_data=None):
+        """Run an FFmpeg command, printing the end of its log and raising RuntimeError on failure."""
+        # Log to a temporary file instead of a pipe so a long render's output is never held in memory
+        with tempfile.TemporaryFile() as log:
+            result = subprocess.run(cmd, input=input_data, stdout=subprocess.DEVNULL, stderr=log)
+            if result.returncode != 0:
+                log.seek(0)
+                tail = deque(log, maxlen=FFMPEG_ERROR_LOG_LINES)
+                print(f"❌ FFmpeg error: {b''.join(tail).decode(errors='replace')}")
+                raise RuntimeError(f"{error_message} (return code {result.returncode})")
+
+    def _build_trajectory(self, keyframes):
+        """
+        Interpolate keyframes into per-frame positions.
+
+        Returns an array of shape (total_frames, 3) holding x, y and rotation
+        (degrees) for every output frame. Each frame uses the first keyframe
+        segment that ends after it, and the last segment extrapolates to the end
+        of the video.
+        """
+        frames = np.array([kf['frame'] for kf in keyframes], dtype=np.float64)
+        values = np.array([[kf['x'], kf['y'], kf['rotation']] for kf in keyframes], dtype=np.float64)
+
+        # Slope of every segment; zero-length segments never move
+        dt = np.diff(frames)
+        slopes = np.divide(np.diff(values, axis=0), dt[:, None],
+                           out=np.zeros((len(dt), 3)), where=dt[:, None] != 0)
 
-        # Close all if statements
-        expr = ''.join(expr_parts) + ')' * (len(keyframes) - 2)
+        # First segment whose end is after the frame (running max keeps the search sorted)
+        t = np.arange(self.total_frames, dtype=np.float64)
+        segment_ends = np.maximum.accumulate(frames[1:-1])
+        idx = np.searchsorted(segment_ends, t, side='right')
 
-        return expr
+        return values[idx] + slopes[idx] * (t - frames[idx])[:, None]
+
+    def _write_motion_commands(self, motion, output):
+        """
+        Write the per-frame piece position and sprite offset as an FFmpeg sendcmd script.
+
+        A command is only emitted when its formatted value changes, so holds and
+        unrotated pieces cost FFmpeg no command processing at all.
+        """
+        # Pieces that never rotate have no sprite columns (and no crop@piece filter)
+        targets = ('overlay@piece x', 'overlay@piece y', 'crop@piece x', 'crop@piece y')[:motion.shape[1]]
+        formats = ('{:.2f}', '{:.2f}', '{:.0f}', '{:.0f}')
+        previous = (None,) * len(targets)
+        lines = []
+
+        for frame, row in enumerate(motion.tolist()):
+            values = tuple(fmt.format(value) for fmt, value in zip(formats, row))
+            commands = [f"{target} {value}" for target, value, last in zip(targets, values, previous)
+                        if value != last]
+            if commands:
+                lines.append(f"{frame / self.fps:.6f} {', '.join(commands)};")
+            previous = values
+
+        with open(output, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def _escape_filter_path(self, path):
+        """Escape a file path for use as a filter option value inside -filter_complex."""
+        path = Path(path).as_posix()
+        # Escape once for the option parser and once more for the filter graph parser
+        for ch in "\\':":
+            path = path.replace(ch, '\\' + ch)
+        for ch in "\\'[],;":
+            path = path.replace(ch, '\\' + ch)
+        return path
 
 
 def parse_arguments():
@@ -1079,6 +1337,9 @@ Examples:
                              help='Video duration in seconds (default: 12)')
     video_group.add_argument('--fps', type=int, default=30,
                              help='Frames per second (default: 30, range: 1-120)')
+    video_group.add_argument('--encoder-preset', type=str, default='fast',
+                             choices=X264_PRESETS,
+                             help='libx264 speed preset (default: fast; ultrafast/veryfast for quick drafts)')
 
     # Piece configuration
     piece_group = parser.add_argument_group('piece configuration')
@@ -1156,7 +1417,8 @@ def main():
             audio_volume=args.audio_volume,
             audio_custom_volume=args.audio_custom_volume,
             alignment_hold_time=args.alignment_hold_time,
-            image_coverage=args.image_coverage
+            image_coverage=args.image_coverage,
+            encoder_preset=args.encoder_preset
         )
 
         print("\n✨ Done! Your puzzle video is ready!")